@@ -1,15 +1,18 @@
 import os
+import asyncio
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from datetime import datetime
 from dotenv import load_dotenv
 import logging
-from fastapi.responses import StreamingResponse
+import orjson
+from fastapi.responses import Response, StreamingResponse
 
 from src.rag_pipeline import RAGPipeline
 
 load_dotenv()
-logging.basicConfig(level=logging.INFO)
+# LOG_LEVEL=DEBUG enables the per-request retrieval/context traces
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger("rag_service")
 
 MONGO_URI = os.getenv("MONGODB_URI") or os.getenv("MONGO_URI")
@@ -29,6 +32,8 @@ else:
     RAG_DATA_FOLDER = os.path.abspath(_default_folder)
 
 PORT = int(os.getenv("PORT", 8000))
+# number of streamed LLM chunks merged into one SSE event
+STREAM_COALESCE_CHUNKS = max(1, int(os.getenv("STREAM_COALESCE_CHUNKS", 6)))
 
 if not GROQ_API_KEY:
     raise RuntimeError("GROQ_API_KEY must be set in .env")
@@ -82,9 +87,9 @@ class ChatRequest(BaseModel):
     evaluate: bool = False
 
 @app.post("/initialize")
-def initialize(req: InitRequest):
+async def initialize(req: InitRequest):
     try:
-        rag.initialize(RAG_DATA_FOLDER, force_rebuild=req.force_rebuild)
+        await asyncio.to_thread(rag.initialize, RAG_DATA_FOLDER, force_rebuild=req.force_rebuild)
         return {"status": "initialized", "data_folder": RAG_DATA_FOLDER}
     except Exception as e:
         logger.exception("Initialization failed")
@@ -96,11 +101,15 @@ def create_session(req: SessionCreate):
     return {"session_id": sid, "title": req.title}
 
 @app.post("/chat")
-def chat(req: ChatRequest):
+async def chat(req: ChatRequest) -> dict:
     if not rag.is_initialized:
         raise HTTPException(status_code=400, detail="RAG not initialized")
     try:
-        out = rag.chat(req.session_id, req.query, include_history=req.include_history, evaluate=req.evaluate)
+        # retrieval, Groq and Mongo calls are blocking; keep them off the event loop
+        out = await asyncio.to_thread(
+            rag.chat, req.session_id, req.query,
+            include_history=req.include_history, evaluate=req.evaluate
+        )
         
         # Ensure all fields in 'out' are JSON-serializable
         # Convert any datetime objects to ISO strings
@@ -116,6 +125,7 @@ def chat(req: ChatRequest):
                 logger.warning(f"Evaluation result is not a dict: {type(out['evaluation'])}")
                 out["evaluation"] = None
         
+        # the return annotation lets FastAPI serialize straight to JSON bytes via Pydantic
         return out
     except Exception as e:
         logger.exception("Chat error")
@@ -128,19 +138,41 @@ async def chat_stream(req: ChatRequest):
         raise HTTPException(status_code=400, detail="RAG not initialized")
     try:
         async def generate():
-            resp = rag.groq_client.chat.completions.create(
+            resp = await rag.async_groq_client.chat.completions.create(
                 model="llama-3.1-8b-instant",
                 messages=[{"role": "user", "content": req.query}],
                 stream=True
             )
-            for chunk in resp:
+            pending = []
+            async for chunk in resp:
                 if chunk.choices[0].delta.content:
-                    yield f"data: {chunk.choices[0].delta.content}\n\n"
+                    pending.append(chunk.choices[0].delta.content)
+                    if len(pending) >= STREAM_COALESCE_CHUNKS:
+                        yield f"data: {''.join(pending)}\n\n"
+                        pending = []
+            if pending:
+                yield f"data: {''.join(pending)}\n\n"
         return StreamingResponse(generate(), media_type="text/event-stream")
     except Exception as e:
         logger.exception("Chat error")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream_rag")
+async def chat_stream_rag(req: ChatRequest):
+    """Full RAG chat (retrieval, history, persistence) streamed as server-sent events."""
+    if not rag.is_initialized:
+        raise HTTPException(status_code=400, detail="RAG not initialized")
+    async def generate():
+        pending = []
+        async for delta in rag.stream_chat(req.session_id, req.query, include_history=req.include_history):
+            pending.append(delta)
+            if len(pending) >= STREAM_COALESCE_CHUNKS:
+                yield f"data: {''.join(pending)}\n\n"
+                pending = []
+        if pending:
+            yield f"data: {''.join(pending)}\n\n"
+    return StreamingResponse(generate(), media_type="text/event-stream")
+
 @app.post("/sessions/{session_id}/reset")
 def reset(session_id: str):
     try:
@@ -162,26 +194,22 @@ def evaluate_retrieval(req: dict):
     
     results = []
     
-    for query in queries:
-        if mode == "both":
-            # Hybrid retrieval
-            hybrid_docs = []
-            if rag.hybrid_retriever:
-                hybrid_results = rag.hybrid_retriever.search(query, k=5)
-                hybrid_docs = [{"text": doc, "score": float(score)} for doc, score in hybrid_results]
-            
-            # Vector-only retrieval
-            vector_results = rag.vector_store.search(query, k=5)
-            vector_docs = [{"text": doc, "score": float(score)} for doc, score in vector_results]
-            
+    if mode == "both":
+        # One batched search per retriever instead of one search per query
+        hybrid_batch = rag.hybrid_retriever.search_batch(queries, k=5) if rag.hybrid_retriever else [[] for _ in queries]
+        vector_batch = rag.vector_store.search_batch(queries, k=5)
+        for query, hybrid_results, vector_results in zip(queries, hybrid_batch, vector_batch):
             results.append({
                 "query": query,
-                "hybrid_results": hybrid_docs,
-                "vector_results": vector_docs
+                "hybrid_results": [{"text": doc, "score": float(score)} for doc, score in hybrid_results],
+                "vector_results": [{"text": doc, "score": float(score)} for doc, score in vector_results]
             })
-        else:
-            # Single mode
-            docs = rag.retrieve_context(query, k=5)
+    else:
+        # Single mode
+        for query in queries:
+            # measure retrieval itself, not the semantic cache
+            docs = rag.retrieve_context(query, k=5, use_cache=False)
             results.append({"query": query, "retrieved": docs[:500]})
     
-    return results
\ No newline at end of file
+    # large score payload: serialize once with orjson, skipping FastAPI's encoding pass
+    return Response(content=orjson.dumps(results), media_type="application/json")
\ No newline at end of file
@@ -17,7 +17,8 @@ class ConversationManager:
             mongo_uri,
             maxPoolSize=50,  # Limit connection pool
             minPoolSize=10,
-            maxIdleTimeMS=45000
+            maxIdleTimeMS=45000,
+            retryWrites=True
         )
         self.db = self.client[db_name]
         self.sessions = self.db.get_collection("sessions")
@@ -25,6 +26,8 @@ class ConversationManager:
         self.summaries = self.db.get_collection("conversation_summaries")
         # in-memory cache for recent exchanges
         self._cache: Dict[str, List[Tuple[str, str, datetime]]] = {}
+        # rendered context string per session, refreshed whenever _cache changes
+        self._ctx_cache: Dict[str, str] = {}
         # ensure indexes
         try:
             self.messages.create_index([("session_id", 1), ("created_at", 1)])
@@ -67,13 +70,13 @@ Concise summary:"""
     def add_exchange(self, session_id: str, user_message: str, bot_response: str, debug: Optional[dict] = None, groq_client=None):
         """Add exchange and create compact summary of bot_response for future context."""
         now = datetime.utcnow()
-        self.messages.insert_one({
+        user_doc = {
             "session_id": session_id,
             "sender": "user",
             "text": user_message,
             "created_at": now,
             "debug": debug.get("user") if isinstance(debug, dict) else None
-        })
+        }
 
         # Create compact summary of assistant response for conversation context
         if self.enable_summarization and groq_client:
@@ -87,15 +90,17 @@ Concise summary:"""
             "sender": "assistant",
             "text": bot_response,  # full response shown to user
             "summary_for_context": response_summary,  # compact version for next turn
-            "created_at": datetime.utcnow(),
+            "created_at": now,
             "debug": debug.get("assistant") if isinstance(debug, dict) else None
         }
-        self.messages.insert_one(assistant_doc)
+        # Both messages in one round trip
+        self.messages.insert_many([user_doc, assistant_doc], ordered=False)
 
         # Update in-memory cache with SUMMARY instead of full response
         self._cache.setdefault(session_id, []).append((user_message, response_summary, now))
         if len(self._cache[session_id]) > self.max_history:
             self._cache[session_id] = self._cache[session_id][-self.max_history:]
+        self._render_context(session_id)
 
     def _estimate_tokens(self, text: str) -> int:
         """Rough token estimate (1 token ≈ 4 chars)."""
@@ -150,13 +155,29 @@ Original summary:
             self.save_summary(session_id, truncated)
             print(f"Warning: summary re-compression failed for session {session_id}: {e}")
 
+    def _render_context(self, session_id: str) -> str:
+        """Build context from user queries + assistant summaries (not full responses)."""
+        parts = []
+        for u, summary, _ in self._cache.get(session_id, []):
+            parts.append(f"User: {u}")
+            parts.append(f"Assistant: {summary}")
+        context = "\n".join(parts)
+        if self._cache.get(session_id):
+            self._ctx_cache[session_id] = context
+        return context
+
     def get_conversation_context(self, session_id: str, groq_client=None) -> str:
         """Get conversation context using response summaries (not full responses) for efficiency."""
+        context = self._ctx_cache.get(session_id)
+        if context is not None:
+            return context
+
         # Load from cache (which now has summaries)
         exchanges = self._cache.get(session_id, [])
         if not exchanges:
             # Rebuild from DB using summary_for_context field
-            msgs = list(self.messages.find({"session_id": session_id}).sort("created_at", -1).limit(self.max_history*2))
+            # user/assistant pairs share created_at; _id (assigned in insert order) breaks the tie
+            msgs = list(self.messages.find({"session_id": session_id}).sort([("created_at", -1), ("_id", -1)]).limit(self.max_history*2))
             msgs = list(reversed(msgs))
             exchanges = []
             i = 0
@@ -174,12 +195,7 @@ Original summary:
                     i += 1
             self._cache[session_id] = exchanges[-self.max_history:]
 
-        # Build context from user queries + assistant summaries (not full responses)
-        parts = []
-        for u, summary, _ in self._cache.get(session_id, []):
-            parts.append(f"User: {u}")
-            parts.append(f"Assistant: {summary}")
-        return "\n".join(parts)
+        return self._render_context(session_id)
 
     def reset_session(self, session_id: str):
         self.messages.delete_many({"session_id": session_id})
@@ -187,3 +203,4 @@ Original summary:
         self.sessions.delete_many({"session_id": session_id})
         if session_id in self._cache:
             del self._cache[session_id]
+        self._ctx_cache.pop(session_id, None)
@@ -0,0 +1,52 @@
+import hashlib
+import sqlite3
+from contextlib import closing
+from typing import List, Optional
+import numpy as np
+
+class EmbeddingCache:
+    """On-disk cache of document embeddings keyed by SHA-256(model id + text).
+
+    The model id must change whenever the vectors would (model, backend, precision).
+
+    Lets a rebuild of the vector store re-embed only new or changed chunks.
+    """
+
+    # stay below SQLite's default limit on bound parameters per statement
+    _BATCH = 500
+
+    def __init__(self, path: str, model_name: str):
+        self.path = path
+        self.model_name = model_name
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS emb_cache (hash TEXT PRIMARY KEY, model TEXT, vec BLOB)"
+            )
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256((self.model_name + "|" + text).encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str], dim: int) -> List[Optional[np.ndarray]]:
+        """Cached float32 embedding for each text, or None where missing."""
+        keys = [self._key(t) for t in texts]
+        found = {}
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            for start in range(0, len(keys), self._BATCH):
+                batch = keys[start:start + self._BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT hash, vec FROM emb_cache WHERE hash IN ({placeholders})", batch
+                ).fetchall()
+                for h, vec in rows:
+                    arr = np.frombuffer(vec, dtype=np.float32)
+                    if arr.shape[0] == dim:
+                        found[h] = arr
+        return [found.get(k) for k in keys]
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        rows = [
+            (self._key(t), self.model_name, np.asarray(e, dtype=np.float32).tobytes())
+            for t, e in zip(texts, embeddings)
+        ]
+        with closing(sqlite3.connect(self.path)) as conn, conn:
+            conn.executemany("INSERT OR REPLACE INTO emb_cache (hash, model, vec) VALUES (?, ?, ?)", rows)
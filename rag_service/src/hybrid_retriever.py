@@ -1,68 +1,173 @@
-from rank_bm25 import BM25Okapi
+import logging
+import re
+from collections import Counter
 import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger("rag_service.retriever")
+
+# Alphanumeric runs of 2+ chars; punctuation no longer sticks to terms ("21," -> "21")
+_TOKEN_RE = re.compile(r"[a-z0-9]{2,}")
 
 class HybridRetriever:
-    def __init__(self, vector_store, documents):
+    def __init__(self, vector_store, documents, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
         self.vector_store = vector_store
         self.documents = documents
+        # Vector hits come back as positions in vector_store.documents; map them
+        # onto our own list only when the two differ.
+        self.doc_to_idx = None if documents is vector_store.documents else {doc: i for i, doc in enumerate(documents)}
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
         # Tokenize docs for BM25
         tokenized = []
         for doc in documents:
-            tokens = doc.lower().split()
-            tokens = [t for t in tokens if len(t) > 1]  # Filter short tokens
+            tokens = self._tokenize(doc)
             tokenized.append(tokens if tokens else ["empty"])
-        
-        self.bm25 = BM25Okapi(tokenized)
-        print(f"DEBUG: BM25 initialized with {len(tokenized)} documents")
-    
-    def search(self, query: str, k: int = 5, alpha: float = 0.5):
-        """Combine BM25 + Vector using Reciprocal Rank Fusion (RRF)."""
-        query_tokens = query.lower().split()
-        query_tokens = [t for t in query_tokens if len(t) > 1]
-        
-        if not query_tokens:
-            print(f"DEBUG: Empty query tokens, using vector-only")
-            return self.vector_store.search(query, k)
-        
-        # Get BM25 ranked results
-        bm25_scores = self.bm25.get_scores(query_tokens)
-        bm25_ranked = np.argsort(bm25_scores)[::-1]  # Descending order
-        
-        # Get Vector ranked results
-        vector_results = self.vector_store.search(query, k=len(self.documents))
+
+        self._build_bm25(tokenized)
+        logger.debug("BM25 initialized with %d documents", len(tokenized))
+
+    def _build_bm25(self, tokenized):
+        """Precompute the BM25 (Okapi) contribution of every (doc, term) pair.
+
+        Scoring a query then reduces to summing a few sparse columns instead of
+        walking every document's term-frequency dict in Python.
+        """
+        self.vocab = {}
+        rows, cols, tfs = [], [], []
+        for doc_idx, tokens in enumerate(tokenized):
+            for term, tf in Counter(tokens).items():
+                rows.append(doc_idx)
+                cols.append(self.vocab.setdefault(term, len(self.vocab)))
+                tfs.append(tf)
+
+        n_docs = len(tokenized)
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        tfs = np.asarray(tfs, dtype=np.float64)
+
+        self.doc_len = np.array([len(tokens) for tokens in tokenized], dtype=np.float64)
+        self.avgdl = self.doc_len.mean() if n_docs else 0.0
+
+        # Same IDF as rank_bm25.BM25Okapi, including the epsilon floor for very common terms
+        df = np.bincount(cols, minlength=len(self.vocab)).astype(np.float64)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = self.epsilon * idf.mean()
+        self.idf = idf
+
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / self.avgdl) if n_docs else 0.0
+        weights = idf[cols] * (tfs * (self.k1 + 1)) / (tfs + norm)
+        # CSC so the per-query column gather is a contiguous slice per term
+        self.bm25_matrix = sparse.csc_matrix((weights, (rows, cols)), shape=(n_docs, len(self.vocab)))
+
+    @staticmethod
+    def _tokenize(text):
+        return _TOKEN_RE.findall(text.lower())
+
+    def _bm25_scores(self, query_tokens):
+        """BM25 score of every document for the given query tokens."""
+        cols = [self.vocab[t] for t in query_tokens if t in self.vocab]
+        if not cols:
+            return np.zeros(len(self.documents))
+        return np.asarray(self.bm25_matrix[:, cols].sum(axis=1)).ravel()
+
+    def _bm25_scores_batch(self, tokenized_queries):
+        """BM25 scores for several queries at once, shape (n_queries, n_docs)."""
+        rows, cols = [], []
+        for q_idx, tokens in enumerate(tokenized_queries):
+            for t in tokens:
+                if t in self.vocab:
+                    rows.append(q_idx)
+                    cols.append(self.vocab[t])
+        # duplicate (row, col) entries are summed, matching repeated query terms
+        query_matrix = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(tokenized_queries), len(self.vocab))
+        )
+        return (query_matrix @ self.bm25_matrix.T).toarray()
+
+    @staticmethod
+    def _top_k(scores, k):
+        """Indices of the k highest scores, best first, without a full sort."""
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def _vector_ranked(self, vector_results):
+        """Map vector-store hit positions onto indices into self.documents."""
         vector_ranked = []
-        for doc, score in vector_results:
-            try:
-                idx = self.documents.index(doc)
-                vector_ranked.append(idx)
-            except ValueError:
-                pass
-        
+        for idx, score in vector_results:
+            if self.doc_to_idx is not None:
+                idx = self.doc_to_idx.get(self.vector_store.documents[idx])
+                if idx is None:
+                    continue
+            vector_ranked.append(idx)
+        return vector_ranked
+
+    def _fuse(self, bm25_scores, vector_results, k, alpha):
+        """Reciprocal Rank Fusion of the top-3k BM25 and vector candidates."""
+        bm25_ranked = self._top_k(bm25_scores, k * 3)  # Descending order
+        vector_ranked = np.asarray(self._vector_ranked(vector_results)[:k*3], dtype=np.int64)
+
         # Reciprocal Rank Fusion (RRF)
-        # Score(d) = sum(1 / (k + rank(d))) for each retrieval method
+        # Score(d) = sum(1 / (k + rank(d))) for each retrieval method,
+        # vector ranks weighted by alpha
         rrf_k = 60  # Standard RRF constant
-        rrf_scores = {}
-        
-        # Add BM25 ranks
-        for rank, doc_idx in enumerate(bm25_ranked[:k*3]):  # Consider top-3k from BM25
-            rrf_scores[doc_idx] = rrf_scores.get(doc_idx, 0) + (1 / (rrf_k + rank + 1))
-        
-        # Add Vector ranks (weighted by alpha)
-        for rank, doc_idx in enumerate(vector_ranked[:k*3]):
-            rrf_scores[doc_idx] = rrf_scores.get(doc_idx, 0) + (alpha / (rrf_k + rank + 1))
-        
-        # Sort by RRF score
-        sorted_docs = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-        
-        # DEBUG
-        top_bm25_score = bm25_scores[bm25_ranked[0]] if len(bm25_ranked) > 0 else 0
-        top_vector_score = vector_results[0][1] if vector_results else 0
-        print(f"DEBUG: BM25_top={top_bm25_score:.4f}, Vector_top={top_vector_score:.4f}, RRF_alpha={alpha}")
-        
+
+        # A document ranked first by both methods has the highest possible RRF score,
+        # so for k=1 fusion can't change the answer. (With a separate doc_to_idx map a
+        # document may appear twice in vector_ranked, so only when indices are shared.)
+        if (k == 1 and self.doc_to_idx is None and len(bm25_ranked) and len(vector_ranked)
+                and bm25_ranked[0] == vector_ranked[0]):
+            doc_idx = int(bm25_ranked[0])
+            return [(self.documents[doc_idx], (1 + alpha) / (rrf_k + 1))]
+
+        rrf_scores = np.zeros(len(self.documents))
+        np.add.at(rrf_scores, bm25_ranked, 1.0 / (rrf_k + np.arange(1, len(bm25_ranked) + 1)))
+        np.add.at(rrf_scores, vector_ranked, alpha / (rrf_k + np.arange(1, len(vector_ranked) + 1)))
+
+        # Top-k by RRF score among the fused candidates
+        candidates = np.union1d(bm25_ranked, vector_ranked)
+        top = candidates[self._top_k(rrf_scores[candidates], k)]
+
+        if logger.isEnabledFor(logging.DEBUG):
+            top_bm25_score = bm25_scores[bm25_ranked[0]] if len(bm25_ranked) > 0 else 0
+            top_vector_score = vector_results[0][1] if vector_results else 0
+            logger.debug("BM25_top=%.4f, Vector_top=%.4f, RRF_alpha=%s", top_bm25_score, top_vector_score, alpha)
+
         # Return top-k with RRF scores
+        return [(self.documents[doc_idx], float(rrf_scores[doc_idx])) for doc_idx in top.tolist()]
+
+    def search(self, query: str, k: int = 5, alpha: float = 0.5):
+        """Combine BM25 + Vector using Reciprocal Rank Fusion (RRF)."""
+        query_tokens = self._tokenize(query)
+
+        if not query_tokens:
+            logger.debug("Empty query tokens, using vector-only")
+            return self.vector_store.search(query, k)
+
+        bm25_scores = self._bm25_scores(query_tokens)
+        # Only the top-3k vector hits are fused, so don't fetch more
+        vector_results = self.vector_store.search_indices(query, k=k*3)
+        return self._fuse(bm25_scores, vector_results, k, alpha)
+
+    def search_batch(self, queries, k: int = 5, alpha: float = 0.5):
+        """search() for many queries, sharing one BM25 matmul and one vector search."""
+        if not queries:
+            return []
+        tokenized = [self._tokenize(q) for q in queries]
+        bm25_scores = self._bm25_scores_batch(tokenized)
+        vector_results = self.vector_store.search_batch_indices(queries, k=k*3)
+
         results = []
-        for doc_idx, rrf_score in sorted_docs[:k]:
-            if doc_idx < len(self.documents):
-                results.append((self.documents[doc_idx], rrf_score))
-        
+        for q_idx, tokens in enumerate(tokenized):
+            if not tokens:
+                # vector-only, same as search()
+                results.append([(self.vector_store.documents[idx], score) for idx, score in vector_results[q_idx][:k]])
+            else:
+                results.append(self._fuse(bm25_scores[q_idx], vector_results[q_idx], k, alpha))
         return results
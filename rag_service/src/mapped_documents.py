@@ -0,0 +1,61 @@
+import mmap
+import operator
+import os
+import struct
+from collections.abc import Sequence
+from typing import List
+import numpy as np
+
+# little-endian uint32: document count, then the byte length before each document
+_U32 = struct.Struct("<I")
+
+class MappedDocuments(Sequence):
+    """Read-only list of strings backed by a memory-mapped file.
+
+    File layout: document count, then (byte length, UTF-8 bytes) per document.
+    Opening makes one pass over the length prefixes; a lookup decodes only the
+    document actually used.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (count,) = _U32.unpack_from(self._data, 0)
+        if _U32.size * (count + 1) > len(self._data):
+            raise ValueError(f"{path} is not a length-prefixed document file")
+        self._starts = np.empty(count, dtype=np.int64)
+        self._ends = np.empty(count, dtype=np.int64)
+        pos = _U32.size
+        for i in range(count):
+            (length,) = _U32.unpack_from(self._data, pos)
+            pos += _U32.size
+            self._starts[i] = pos
+            pos += length
+            self._ends[i] = pos
+        if pos != len(self._data):
+            raise ValueError(f"{path} is truncated or not a length-prefixed document file")
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = operator.index(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("document index out of range")
+        return self._data[self._starts[i]:self._ends[i]].decode("utf-8")
+
+    @staticmethod
+    def write(documents: List[str], path: str):
+        """Write documents in the layout read by MappedDocuments."""
+        # write beside and rename, so an existing mapping of the old file stays valid
+        with open(path + ".tmp", "wb") as f:
+            f.write(_U32.pack(len(documents)))
+            for doc in documents:
+                data = doc.encode("utf-8")
+                f.write(_U32.pack(len(data)))
+                f.write(data)
+        os.replace(path + ".tmp", path)
@@ -1,18 +1,97 @@
 import os
-from typing import List, Optional, Dict
-from groq import Groq
+import asyncio
+import logging
+from datetime import datetime
+from functools import lru_cache, partial
+from typing import List, Optional, Dict, Tuple
+from groq import Groq, AsyncGroq
 from .document_processor import DocumentProcessor
 from .vector_store import VectorStore
 from .conversation_manager import ConversationManager
 from .legal_evaluator import LegalEvaluationManager
 from .hybrid_retriever import HybridRetriever
+from .semantic_cache import SemanticCache
 import re
 
+logger = logging.getLogger("rag_service.pipeline")
+
+# Query classification vocab, built once instead of on every chat turn
+_GREETING_WORDS = frozenset({'hi', 'hey', 'hello', 'yo', 'thanks', 'thx', 'bye'})
+_GREETING_PHRASES = frozenset({'good morning', 'good night', 'good evening', 'thank you', 'thanks a lot'})
+# Keywords match as substrings (e.g. "rights" inside "fundamental rights"), so they are
+# compiled into one alternation rather than checked token-by-token
+_LEGAL_KEYWORDS_RE = re.compile("|".join(map(re.escape, [
+    "article", "section", "act", "law", "rights", "ipc", "judgment", "judgement",
+    "court", "statute", "contract", "evidence", "penalty", "fine", "offence", "crime",
+    "liable", "liability", "divorce", "marriage", "custody", "writ", "injunction"
+])))
+_INFORMATIONAL_STARTERS = (
+    'explain', 'what is', 'what are', 'what was', 'what does',
+    'who', 'when', 'where', 'why', 'how', 'which',
+    'define', 'describe', 'list', 'tell me about'
+)
+_SPECIFIC_LEGAL_TERMS_RE = re.compile("|".join(map(re.escape, [
+    'article', 'section', 'act', 'ipc', 'crpc', 'constitution',
+    'amendment', 'schedule', 'panchayat', 'fundamental rights',
+    'directive principles', 'udhr', 'iccpr'
+])))
+# Follow-up indicators: pronouns need the LLM to resolve what they refer to...
+_PRONOUN_RE = re.compile("|".join([
+    r'\bthat\b',           # "explain that"
+    r'\bthis\b',           # "what about this"
+    r'\bthose\b',          # "give those examples"
+    r'\bit\b',             # "elaborate on it"
+    r'\bthem\b',           # "list them"
+]))
+# ...while "more"/"give examples" style requests just continue the last topic
+_EXPANSION_RE = re.compile("|".join([
+    r'^(more|another)',    # starts with "more" or "another"
+    r'^(give|show|provide)\s+(me\s+)?(examples?|details?)',  # "give examples"
+]))
+# Provision references used as the topic of an expansion follow-up
+_TOPIC_RE = re.compile(r'\b(?:article|section|schedule|amendment|part)\s+\d+[a-z]?\b', re.IGNORECASE)
+# Any number in a query ("IPC 302", "14 and 15") can identify a provision too
+_NUMBER_RE = re.compile(r'\b\d+[a-z]?\b', re.IGNORECASE)
+def _provision_signature(query: str) -> str:
+    """Sorted provision references and numbers in the query.
+
+    Used as the semantic cache tag: "Article 14" and "Article 15" questions embed
+    almost identically, so only an exact signature match may share an entry.
+    """
+    refs = {" ".join(t.lower().split()) for t in _TOPIC_RE.findall(query)}
+    refs.update(n.lower() for n in _NUMBER_RE.findall(query))
+    return "|".join(sorted(refs))
+
+# History passed to the rewrite LLM, in estimated tokens (1 token ≈ 4 chars)
+_REWRITE_HISTORY_TOKENS = 200
+
+# ✅ IMPROVED: More specific system prompt
+_SYSTEM_PROMPT = """You are a legal assistant specializing in Indian constitutional law and human rights.
+
+Your knowledge domains:
+- Indian Constitution (Articles, Amendments, Schedules)
+- Fundamental Rights (Articles 12-35)
+- Directive Principles of State Policy
+- Universal Declaration of Human Rights (UDHR)
+- Constitutional governance structures (Panchayati Raj, etc.)
+
+Guidelines:
+1. Always cite specific Articles/Sections when applicable
+2. Distinguish between constitutional rights vs. human rights treaties
+3. If context lacks relevant information, say: "Based on the available documents, I don't have specific information on this topic."
+4. Use clear, accessible language while maintaining legal accuracy
+"""
+
 class RAGPipeline:
     def __init__(self, groq_api_key: str, index_dir: Optional[str] = None, mongo_uri: Optional[str] = None, db_name: Optional[str] = None):
         self.groq_client = Groq(api_key=groq_api_key)
+        # used by streaming endpoints so network reads don't block the event loop
+        self.async_groq_client = AsyncGroq(api_key=groq_api_key)
         self.document_processor = DocumentProcessor()
-        self.vector_store = VectorStore(index_dir=index_dir)
+        self.vector_store = VectorStore(
+            index_dir=index_dir,
+            static_model=os.getenv("STATIC_EMBEDDINGS", "false").lower() == "true"
+        )
         self.conversation_manager = ConversationManager(mongo_uri=mongo_uri, db_name=db_name)
         # evaluator optional
         try:
@@ -26,6 +105,14 @@ class RAGPipeline:
         # safe minimum k
         self.min_k = 1
         self.hybrid_retriever = None  # Initialize after documents loaded
+        # pending persistence tasks of streamed responses
+        self._background_tasks = set()
+        # (query, recent history) -> rewritten query
+        self._llm_rewrite_cached = lru_cache(maxsize=256)(self._llm_rewrite)
+        # semantic caches keyed by query embedding (size 0 disables)
+        cache_size = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))
+        self.context_cache = SemanticCache(cache_size, threshold=float(os.getenv("CONTEXT_CACHE_THRESHOLD", "0.95")))
+        self.response_cache = SemanticCache(cache_size, threshold=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.97")))
 
     def initialize(self, data_folder: str, force_rebuild: bool = False):
         vector_dir = self.vector_store.index_dir
@@ -33,45 +120,75 @@ class RAGPipeline:
         if not force_rebuild:
             loaded = self.vector_store.load()
         if loaded:
-            print("Loaded existing vector store.")
+            logger.info("Loaded existing vector store.")
         else:
             chunks = self.document_processor.process_documents(data_folder)
             if not chunks:
                 raise RuntimeError("No documents found in data folder")
-            print(f"Processing {len(chunks)} chunks")
+            logger.info("Processing %d chunks", len(chunks))
+            if force_rebuild:
+                # a store loaded at startup would otherwise dedupe every chunk away
+                # and keep its old index, settings and removed documents
+                self.vector_store.reset()
             self.vector_store.add_documents(chunks)
             self.vector_store.save()
-            print("Vector store built and saved.")
+            logger.info("Vector store built and saved.")
         
         # Initialize hybrid retriever after vector store is ready
         if self.vector_store.documents:
             try:
                 self.hybrid_retriever = HybridRetriever(self.vector_store, self.vector_store.documents)
-                print("Hybrid retriever initialized.")
+                logger.info("Hybrid retriever initialized.")
             except Exception as e:
-                print(f"Hybrid retriever failed: {e}, falling back to vector-only")
+                logger.warning("Hybrid retriever failed: %s, falling back to vector-only", e)
                 self.hybrid_retriever = None
         
+        # cached contexts/answers may refer to the previous corpus
+        self.context_cache.clear()
+        self.response_cache.clear()
         self.is_initialized = True
 
-    def retrieve_context(self, query: str, k: int = 3) -> str:
+    def retrieve_results(self, query: str, k: int = 3, use_cache: bool = True) -> List[Tuple[str, float]]:
+        """Ranked (document, score) pairs for the query, best first.
+
+        use_cache=False always retrieves for this exact query (e.g. when evaluating retrieval).
+        """
         if not self.is_initialized:
-            return ""
+            return []
+
+        if use_cache:
+            q_emb = self.vector_store.encode_query(query)
+            tag = f"{k}#{_provision_signature(query)}"
+            cached = self.context_cache.get(q_emb, tag=tag)
+            if cached is not None:
+                logger.debug("Context cache hit for query: %.50s...", query)
+                return cached
         
         # Use hybrid search if available, else fallback to vector-only
         if self.hybrid_retriever:
-            print(f"DEBUG: Using HYBRID retrieval for query: {query[:50]}...")  # ← Add this
+            logger.debug("Using HYBRID retrieval for query: %.50s...", query)
             results = self.hybrid_retriever.search(query, k, alpha=0.9)  # ← Try 90% vector, 10% BM25 first
         else:
-            print(f"DEBUG: Using VECTOR-ONLY retrieval for query: {query[:50]}...")  # ← Add this
+            logger.debug("Using VECTOR-ONLY retrieval for query: %.50s...", query)
             results = self.vector_store.search(query, k)
         
+        if use_cache:
+            self.context_cache.put(q_emb, results, tag=tag)
+        return results
+
+    @staticmethod
+    def _format_context(results: List[Tuple[str, float]], k: int) -> str:
+        """Join the top-k retrieved documents into a prompt context."""
+        results = results[:k]
         context_parts = [doc for doc, score in results if score > 0.2]
         # fallback take top-k even if low score
         if not context_parts and results:
-            context_parts = [doc for doc, score in results[:k]]
+            context_parts = [doc for doc, score in results]
         return "\n\n".join(context_parts)
 
+    def retrieve_context(self, query: str, k: int = 3, use_cache: bool = True) -> str:
+        return self._format_context(self.retrieve_results(query, k, use_cache=use_cache), k)
+
     def _estimate_tokens(self, text: str) -> int:
         """Same heuristic as ConversationManager (1 token ≈ 4 chars)."""
         if not text:
@@ -82,16 +199,15 @@ class RAGPipeline:
         if not query:
             return False
         q = query.strip().lower()
+        n_words = len(q.split())
         
         # Very short single-word greetings
-        if len(q.split()) == 1 and q in ['hi', 'hey', 'hello', 'yo', 'thanks', 'thx', 'bye']:
+        if n_words == 1 and q in _GREETING_WORDS:
             return True
         
         # Short polite phrases (2 words max)
-        if len(q.split()) <= 2:
-            greeting_patterns = ['good morning', 'good night', 'good evening', 'thank you', 'thanks a lot']
-            if q in greeting_patterns:
-                return True
+        if n_words <= 2 and q in _GREETING_PHRASES:
+            return True
         
         return False
 
@@ -104,48 +220,40 @@ class RAGPipeline:
             return True
         if len(q) > 40:
             return True
-        legal_keywords = [
-            "article", "section", "act", "law", "rights", "ipc", "judgment", "judgement",
-            "court", "statute", "contract", "evidence", "penalty", "fine", "offence", "crime",
-            "liable", "liability", "divorce", "marriage", "custody", "writ", "injunction"
-        ]
-        for kw in legal_keywords:
-            if kw in q:
-                return True
-        return False
+        return _LEGAL_KEYWORDS_RE.search(q) is not None
 
-    def generate_response(self, query: str, context: str, conversation_context: str = "") -> str:
-        # ✅ IMPROVED: More specific system prompt
-        system_prompt = """You are a legal assistant specializing in Indian constitutional law and human rights.
-
-Your knowledge domains:
-- Indian Constitution (Articles, Amendments, Schedules)
-- Fundamental Rights (Articles 12-35)
-- Directive Principles of State Policy
-- Universal Declaration of Human Rights (UDHR)
-- Constitutional governance structures (Panchayati Raj, etc.)
-
-Guidelines:
-1. Always cite specific Articles/Sections when applicable
-2. Distinguish between constitutional rights vs. human rights treaties
-3. If context lacks relevant information, say: "Based on the available documents, I don't have specific information on this topic."
-4. Use clear, accessible language while maintaining legal accuracy
-"""
-        
+    @staticmethod
+    def _build_messages(query: str, context: str, conversation_context: str = "") -> List[Dict]:
         user_prompt = f"Conversation:\n{conversation_context}\n\nContext:\n{context}\n\nQuestion: {query}"
+        return [
+            {"role": "system", "content": _SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def generate_response(self, query: str, context: str, conversation_context: str = "", query_embedding=None) -> str:
+        # Answers only depend on the query when there is no conversation to resolve against
+        cacheable = query_embedding is not None and not conversation_context
+        if cacheable:
+            tag = _provision_signature(query)
+            cached = self.response_cache.get(query_embedding, tag=tag)
+            if cached is not None:
+                logger.debug("Response cache hit for query: %.50s...", query)
+                return cached
+
+        messages = self._build_messages(query, context, conversation_context)
         try:
             resp = self.groq_client.chat.completions.create(
                 model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
+                messages=messages,
                 temperature=0.2,
                 max_tokens=1000
             )
-            return resp.choices[0].message.content
+            response_text = resp.choices[0].message.content
+            if cacheable:
+                self.response_cache.put(query_embedding, response_text, tag=tag)
+            return response_text
         except Exception as e:
-            print(f"LLM error: {e}")
+            logger.error("LLM error: %s", e)
             return f"Error generating response: {e}"
 
     def rewrite_query_with_context(self, query: str, conversation_context: str) -> str:
@@ -158,50 +266,57 @@ Guidelines:
         if len(query.split()) > 15:
             return query
         
+        q = query.lower().strip()
+
         # ✅ RULE 3: Skip if query starts with informational keywords (new topic)
-        informational_starters = [
-            'explain', 'what is', 'what are', 'what was', 'what does',
-            'who', 'when', 'where', 'why', 'how', 'which',
-            'define', 'describe', 'list', 'tell me about'
-        ]
-        if any(query.lower().strip().startswith(starter) for starter in informational_starters):
-            print(f"DEBUG: Skipping rewrite - query starts with informational keyword")
+        if q.startswith(_INFORMATIONAL_STARTERS):
+            logger.debug("Skipping rewrite - query starts with informational keyword")
             return query
         
         # ✅ RULE 4: Skip if query contains specific legal terms (likely standalone)
-        specific_legal_terms = [
-            'article', 'section', 'act', 'ipc', 'crpc', 'constitution',
-            'amendment', 'schedule', 'panchayat', 'fundamental rights',
-            'directive principles', 'udhr', 'iccpr'
-        ]
-        if any(term in query.lower() for term in specific_legal_terms):
-            print(f"DEBUG: Skipping rewrite - query contains specific legal term")
+        if _SPECIFIC_LEGAL_TERMS_RE.search(q):
+            logger.debug("Skipping rewrite - query contains specific legal term")
             return query
         
         # ✅ RULE 5: Only rewrite if query has STRONG follow-up indicators
-        strong_follow_up_patterns = [
-            r'\bthat\b',           # "explain that"
-            r'\bthis\b',           # "what about this"
-            r'\bthose\b',          # "give those examples"
-            r'\bit\b',             # "elaborate on it"
-            r'\bthem\b',           # "list them"
-            r'^(more|another)',    # starts with "more" or "another"
-            r'^(give|show|provide)\s+(me\s+)?(examples?|details?)',  # "give examples"
-        ]
+        has_pronoun = _PRONOUN_RE.search(q) is not None
+        has_expansion = _EXPANSION_RE.search(q) is not None
         
-        has_follow_up = any(re.search(pattern, query.lower()) for pattern in strong_follow_up_patterns)
-        
-        if not has_follow_up:
-            print(f"DEBUG: Skipping rewrite - no strong follow-up indicators")
+        if not (has_pronoun or has_expansion):
+            logger.debug("Skipping rewrite - no strong follow-up indicators")
             return query
         
+        # ✅ "more" / "give examples" without a pronoun: attach the last provision discussed
+        if not has_pronoun:
+            topics = _TOPIC_RE.findall(conversation_context)
+            if topics:
+                rewritten = f"{query.strip()} about {topics[-1]}"
+                logger.debug("Query rewritten locally from '%s' to '%s'", query, rewritten)
+                return rewritten
+        
         # ✅ ONLY NOW do we attempt rewriting (high confidence it's a follow-up)
-        print(f"DEBUG: Detected follow-up query, attempting rewrite...")
+        logger.debug("Detected follow-up query, attempting rewrite...")
         
+        try:
+            rewritten = self._llm_rewrite_cached(query, conversation_context[-_REWRITE_HISTORY_TOKENS * 4:])
+        except Exception as e:
+            logger.warning("Rewrite failed (%s), using original", e)
+            return query
+            
+        # ✅ Safety check: if rewritten is too different (>2x length), use original
+        if len(rewritten.split()) > len(query.split()) * 2:
+            logger.debug("Rewrite too verbose, using original")
+            return query
+        
+        logger.debug("Query rewritten from '%s' to '%s'", query, rewritten)
+        return rewritten
+
+    def _llm_rewrite(self, query: str, history: str) -> str:
+        """Ask the LLM to make a follow-up self-contained. Raises on API errors so they aren't cached."""
         rewrite_prompt = f"""You are rewriting a follow-up legal question to be self-contained.
 
 Previous conversation (last 2 turns):
-{conversation_context[-800:]}
+{history}
 
 User's follow-up: {query}
 
@@ -213,74 +328,54 @@ Rules:
 
 Rewritten question:"""
 
-        try:
-            resp = self.groq_client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[{"role": "user", "content": rewrite_prompt}],
-                temperature=0.05,  # ✅ Lower temp for more consistent rewrites
-                max_tokens=50
-            )
-            rewritten = resp.choices[0].message.content.strip()
-            
-            # ✅ Safety check: if rewritten is too different (>2x length), use original
-            if len(rewritten.split()) > len(query.split()) * 2:
-                print(f"DEBUG: Rewrite too verbose, using original")
-                return query
-            
-            print(f"DEBUG: Query rewritten from '{query}' to '{rewritten}'")
-            return rewritten
-            
-        except Exception as e:
-            print(f"DEBUG: Rewrite failed ({e}), using original")
-            return query
+        resp = self.groq_client.chat.completions.create(
+            model="llama-3.1-8b-instant",
+            messages=[{"role": "user", "content": rewrite_prompt}],
+            temperature=0,  # ✅ Deterministic, so cached rewrites stay valid
+            max_tokens=50
+        )
+        return resp.choices[0].message.content.strip()
+
+    def _greeting_debug(self, query: str) -> Dict:
+        return {
+            "conversation_context_preview": "",
+            "retrieved_context_preview": "",
+            "tokens_estimate": {
+                "conversation": 0,
+                "retrieved": 0,
+                "query": self._estimate_tokens(query),
+                "total_context_allowed": self.model_max_tokens - self.reserved_response_tokens
+            },
+            "used_k": 0,
+            "note": "retrieval_skipped_greeting"
+        }
 
-    def chat(self, session_id: str, query: str, include_history: bool = True, evaluate: bool = False) -> Dict:
-        """Chat with turn-by-turn summarization and query rewriting for follow-ups."""
-        # If the query is non-informational (greeting/chit-chat), skip retrieval entirely.
-        if self.is_greeting(query) and not self.is_informational(query):
-            print(f"DEBUG: Skipping retrieval for greeting: '{query[:120]}' (session {session_id})")
-            response_text = self.generate_response(query, context="", conversation_context="")
-            debug = {
-                "conversation_context_preview": "",
-                "retrieved_context_preview": "",
-                "tokens_estimate": {
-                    "conversation": 0,
-                    "retrieved": 0,
-                    "query": self._estimate_tokens(query),
-                    "total_context_allowed": self.model_max_tokens - self.reserved_response_tokens
-                },
-                "used_k": 0,
-                "note": "retrieval_skipped_greeting"
+    def _save_messages(self, session_id: str, query: str, response_text: str, user_debug: Dict, debug: Dict):
+        """Store a user/assistant pair without summarization, in one round trip."""
+        now = datetime.utcnow()
+        self.conversation_manager.messages.insert_many([
+            {
+                "session_id": session_id,
+                "sender": "user",
+                "text": query,
+                "created_at": now,
+                "debug": user_debug
+            },
+            {
+                "session_id": session_id,
+                "sender": "assistant",
+                "text": response_text,
+                "created_at": now,
+                "debug": debug
             }
+        ], ordered=False)
 
-            try:
-                self.conversation_manager.messages.insert_one({
-                    "session_id": session_id,
-                    "sender": "user",
-                    "text": query,
-                    "created_at": __import__("datetime").datetime.utcnow(),
-                    "debug": {"note": "greeting_user_input"}
-                })
-                self.conversation_manager.messages.insert_one({
-                    "session_id": session_id,
-                    "sender": "assistant",
-                    "text": response_text,
-                    "created_at": __import__("datetime").datetime.utcnow(),
-                    "debug": debug
-                })
-            except Exception:
-                pass
-
-            evaluation = None
-            if evaluate and self.evaluator:
-                try:
-                    evaluation = self.evaluator.evaluate_conversation_turn(session_id, query, response_text, context="")
-                except Exception as e:
-                    print(f"Evaluation failed for greeting: {e}")
-
-            return {"response": response_text, "debug": debug, "evaluation": evaluation}
+    def prepare_context(self, session_id: str, query: str, include_history: bool = True) -> Dict:
+        """Rewrite the query, retrieve and fit contexts into the token budget.
 
-        # Informational query - full RAG flow
+        Returns the (possibly rewritten) query, the conversation and retrieved
+        contexts to prompt with, and the debug payload for the turn.
+        """
         desired_k = int(os.getenv("RETRIEVE_K", "5"))
         k = desired_k
 
@@ -295,15 +390,16 @@ Rewritten question:"""
 
         available_context_tokens = max(256, self.model_max_tokens - self.reserved_response_tokens)
         query_tokens = self._estimate_tokens(query)
+        # token estimates are recomputed only when the corresponding text changes
+        conv_tokens = self._estimate_tokens(conversation_context)
 
+        # Retrieve once at the desired k; shrinking k below only trims this ranked list
+        results = self.retrieve_results(query, desired_k)
         retrieved_context = ""
         while True:
-            retrieved_context = self.retrieve_context(query, k)
-            tokens_total = (
-                self._estimate_tokens(conversation_context)
-                + self._estimate_tokens(retrieved_context)
-                + query_tokens
-            )
+            retrieved_context = self._format_context(results, k)
+            retrieved_tokens = self._estimate_tokens(retrieved_context)
+            tokens_total = conv_tokens + retrieved_tokens + query_tokens
 
             if tokens_total <= available_context_tokens:
                 break
@@ -312,11 +408,8 @@ Rewritten question:"""
                 try:
                     self.conversation_manager.ensure_summary_limit(session_id, self.groq_client, max_summary_tokens=500)
                     conversation_context = self.conversation_manager.get_conversation_context(session_id, groq_client=None)
-                    tokens_total = (
-                        self._estimate_tokens(conversation_context)
-                        + self._estimate_tokens(retrieved_context)
-                        + query_tokens
-                    )
+                    conv_tokens = self._estimate_tokens(conversation_context)
+                    tokens_total = conv_tokens + retrieved_tokens + query_tokens
                     if tokens_total <= available_context_tokens:
                         break
                 except Exception:
@@ -326,50 +419,34 @@ Rewritten question:"""
                 k = max(self.min_k, k - 1)
                 continue
 
-            allowed_tokens_for_retrieved = max(0, available_context_tokens - self._estimate_tokens(conversation_context) - query_tokens)
+            allowed_tokens_for_retrieved = max(0, available_context_tokens - conv_tokens - query_tokens)
             if allowed_tokens_for_retrieved <= 0:
                 conv_chars_keep = max(0, (available_context_tokens // 2) * 4)
                 conversation_context = (conversation_context[-conv_chars_keep:]) if conv_chars_keep > 0 else ""
-                allowed_tokens_for_retrieved = max(0, available_context_tokens - self._estimate_tokens(conversation_context) - query_tokens)
+                conv_tokens = self._estimate_tokens(conversation_context)
+                allowed_tokens_for_retrieved = max(0, available_context_tokens - conv_tokens - query_tokens)
 
             char_limit = allowed_tokens_for_retrieved * 4
             if char_limit < len(retrieved_context):
                 retrieved_context = retrieved_context[:char_limit]
+                retrieved_tokens = self._estimate_tokens(retrieved_context)
             break
 
-        try:
-            print("\n" + "="*80)
-            print(f"DEBUG: SESSION_ID: {session_id}")
-            print("="*80)
-            print(f"DEBUG: Conversation context length: {len(conversation_context)} chars")
-            if conversation_context:
-                print("DEBUG: Conversation context preview:")
-                print(conversation_context[:1000])
-            print("-"*80)
-            print(f"DEBUG: Retrieved context length: {len(retrieved_context)} chars (using k={k})")
-            if retrieved_context:
-                print("DEBUG: Retrieved context preview:")
-                print(retrieved_context[:1000])
-            print("="*80 + "\n")
-        except Exception as e:
-            print(f"DEBUG: Failed to print debug context: {e}")
-
-        response_text = self.generate_response(query, retrieved_context, conversation_context)
-
-        try:
-            print("\n" + "="*80)
-            print(f"DEBUG: GENERATED RESPONSE (session {session_id}) - preview:")
-            print(response_text[:2000])
-            print("="*80 + "\n")
-        except Exception:
-            pass
+        # previews are only sliced when debug logging is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "SESSION_ID: %s\nConversation context length: %d chars\n%s\n%s\n"
+                "Retrieved context length: %d chars (using k=%d)\n%s",
+                session_id, len(conversation_context), conversation_context[:1000], "-"*80,
+                len(retrieved_context), k, retrieved_context[:1000]
+            )
 
         debug = {
             "conversation_context_preview": conversation_context[:1000],
             "retrieved_context_preview": retrieved_context[:2000],
             "tokens_estimate": {
-                "conversation": self._estimate_tokens(conversation_context),
-                "retrieved": self._estimate_tokens(retrieved_context),
+                "conversation": conv_tokens,
+                "retrieved": retrieved_tokens,
                 "query": query_tokens,
                 "total_context_allowed": available_context_tokens
             },
@@ -379,27 +456,67 @@ Rewritten question:"""
             "rewritten_query": query if original_query != query else None
         }
 
+        return {
+            "query": query,
+            "conversation_context": conversation_context,
+            "retrieved_context": retrieved_context,
+            "debug": debug
+        }
+
+    def _save_exchange(self, session_id: str, prepared: Dict, response_text: str, include_history: bool):
         if include_history:
             self.conversation_manager.add_exchange(
-                session_id, query, response_text,
-                debug={"assistant": debug},
+                session_id, prepared["query"], response_text,
+                debug={"assistant": prepared["debug"]},
                 groq_client=self.groq_client
             )
         else:
-            self.conversation_manager.messages.insert_one({
-                "session_id": session_id,
-                "sender": "user",
-                "text": query,
-                "created_at": __import__("datetime").datetime.utcnow(),
-                "debug": {"retrieved_context_preview": retrieved_context[:500]}
-            })
-            self.conversation_manager.messages.insert_one({
-                "session_id": session_id,
-                "sender": "assistant",
-                "text": response_text,
-                "created_at": __import__("datetime").datetime.utcnow(),
-                "debug": debug
-            })
+            self._save_messages(
+                session_id, prepared["query"], response_text,
+                {"retrieved_context_preview": prepared["retrieved_context"][:500]},
+                prepared["debug"]
+            )
+
+    def chat(self, session_id: str, query: str, include_history: bool = True, evaluate: bool = False) -> Dict:
+        """Chat with turn-by-turn summarization and query rewriting for follow-ups."""
+        # If the query is non-informational (greeting/chit-chat), skip retrieval entirely.
+        if self.is_greeting(query) and not self.is_informational(query):
+            logger.debug("Skipping retrieval for greeting: '%.120s' (session %s)", query, session_id)
+            response_text = self.generate_response(
+                query, context="", conversation_context="",
+                query_embedding=self.vector_store.encode_query(query)
+            )
+            debug = self._greeting_debug(query)
+
+            try:
+                self._save_messages(session_id, query, response_text, {"note": "greeting_user_input"}, debug)
+            except Exception:
+                pass
+
+            evaluation = None
+            if evaluate and self.evaluator:
+                try:
+                    evaluation = self.evaluator.evaluate_conversation_turn(session_id, query, response_text, context="")
+                except Exception as e:
+                    logger.warning("Evaluation failed for greeting: %s", e)
+
+            return {"response": response_text, "debug": debug, "evaluation": evaluation}
+
+        # Informational query - full RAG flow
+        prepared = self.prepare_context(session_id, query, include_history)
+        query = prepared["query"]
+        retrieved_context = prepared["retrieved_context"]
+        conversation_context = prepared["conversation_context"]
+
+        response_text = self.generate_response(
+            query, retrieved_context, conversation_context,
+            query_embedding=None if conversation_context else self.vector_store.encode_query(query)
+        )
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("GENERATED RESPONSE (session %s) - preview:\n%s", session_id, response_text[:2000])
+
+        self._save_exchange(session_id, prepared, response_text, include_history)
 
         evaluation = None
         if evaluate and self.evaluator:
@@ -413,7 +530,54 @@ Rewritten question:"""
                 if evaluation and not isinstance(evaluation, dict):
                     evaluation = None
             except Exception as e:
-                print(f"Evaluation failed: {e}")
+                logger.warning("Evaluation failed: %s", e)
                 evaluation = None
 
-        return {"response": response_text, "debug": debug, "evaluation": evaluation}
\ No newline at end of file
+        return {"response": response_text, "debug": prepared["debug"], "evaluation": evaluation}
+
+    async def stream_chat(self, session_id: str, query: str, include_history: bool = True):
+        """Async generator of response text deltas for a full RAG turn.
+
+        Retrieval runs in a worker thread before the first token; the exchange
+        is persisted in the background once the stream completes.
+        """
+        if self.is_greeting(query) and not self.is_informational(query):
+            greeting = True
+            prepared = {"query": query, "conversation_context": "", "retrieved_context": "", "debug": self._greeting_debug(query)}
+        else:
+            greeting = False
+            prepared = await asyncio.to_thread(self.prepare_context, session_id, query, include_history)
+
+        resp = await self.async_groq_client.chat.completions.create(
+            model="llama-3.1-8b-instant",
+            messages=self._build_messages(prepared["query"], prepared["retrieved_context"], prepared["conversation_context"]),
+            temperature=0.2,
+            max_tokens=1000,
+            stream=True
+        )
+        parts = []
+        async for chunk in resp:
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+
+        response_text = "".join(parts)
+        if greeting:
+            save = partial(
+                self._save_messages, session_id, query, response_text,
+                {"note": "greeting_user_input"}, prepared["debug"]
+            )
+        else:
+            save = partial(self._save_exchange, session_id, prepared, response_text, include_history)
+        task = asyncio.create_task(self._run_background(save))
+        # keep a reference so the task isn't garbage-collected before it finishes
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    @staticmethod
+    async def _run_background(fn):
+        try:
+            await asyncio.to_thread(fn)
+        except Exception as e:
+            logger.error("Failed to save streamed exchange: %s", e)
@@ -0,0 +1,58 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class SemanticCache:
+    """LRU cache keyed by query embedding.
+
+    A lookup hits when a cached query's cosine similarity to the new one is at
+    least `threshold`. Embeddings are expected to be L2-normalized, so a single
+    matrix-vector product scores every entry. Only entries with an equal `tag`
+    (an int or str) can match.
+    """
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: OrderedDict = OrderedDict()  # entry id -> (embedding, tag, value)
+        self._next_id = 0
+        self._lock = threading.Lock()
+        # stacked embeddings/tags of all entries, rebuilt lazily after inserts/evictions
+        self._ids = None
+        self._matrix = None
+        self._tags = None
+
+    def get(self, embedding: np.ndarray, tag=0):
+        """Return the cached value for the most similar query with the same tag, or None."""
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            if not self._entries:
+                return None
+            if self._matrix is None:
+                self._ids = list(self._entries.keys())
+                self._matrix = np.stack([e[0] for e in self._entries.values()])
+                self._tags = np.array([e[1] for e in self._entries.values()], dtype=object)
+            sims = self._matrix @ np.ravel(embedding)
+            sims[self._tags != tag] = -np.inf
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            entry_id = self._ids[best]
+            self._entries.move_to_end(entry_id)
+            return self._entries[entry_id][2]
+
+    def put(self, embedding: np.ndarray, value, tag=0):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[self._next_id] = (np.array(embedding, dtype=np.float32).ravel(), tag, value)
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
@@ -1,58 +1,520 @@
 import os
+import sys
+import atexit
+import hashlib
+import json
+import logging
 import pickle
-from typing import List, Tuple
+from functools import lru_cache
+from typing import Iterator, List, Sequence, Tuple
 import numpy as np
+import torch
 
 from sentence_transformers import SentenceTransformer
 import faiss
 
+try:
+    import xxhash
+except ImportError:
+    # optional: faster document hashing for deduplication
+    xxhash = None
+
+from .embedding_cache import EmbeddingCache
+from .mapped_documents import MappedDocuments
+
+logger = logging.getLogger("rag_service.vector_store")
+
+# Default to one intra-op thread per physical core (assuming 2-way SMT): more
+# threads than cores oversubscribe and slow inference down. With several server
+# workers per host, set TORCH_NUM_THREADS / OMP_NUM_THREADS=1 per worker instead.
+torch.set_num_threads(int(os.getenv("TORCH_NUM_THREADS", "0")) or max(1, (os.cpu_count() or 2) // 2))
+try:
+    # encoding runs one op at a time, so inter-op threads would only sit idle
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    # already set, or parallel work has started in this process
+    pass
+
+def _cpu_has_vnni() -> bool:
+    try:
+        with open("/proc/cpuinfo") as f:
+            return "avx512_vnni" in f.read()
+    except OSError:
+        return False
+
+# documents are deduplicated by a 64-bit hash of their text
+_DOC_HASH_NAME = "xxh3" if xxhash is not None else "blake2b"
+
+def _doc_hash(doc: str) -> int:
+    data = doc.encode("utf-8")
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(data)
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+def _is_mean_pooling(pooling) -> bool:
+    mode = getattr(pooling, "pooling_mode", None)
+    if mode is None and hasattr(pooling, "get_pooling_mode_str"):
+        # older sentence-transformers
+        mode = pooling.get_pooling_mode_str()
+    return mode == "mean"
+
 class VectorStore:
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", index_dir: str = None):
-        self.model = SentenceTransformer(model_name)
-        self.dim = self.model.get_sentence_embedding_dimension()
-        self.index = None
-        self.documents: List[str] = []
+    INDEX_TYPES = ("flat", "sq_fp16", "sq8", "hnsw", "hnsw_sq8", "ivfpq")
+    # model2vec distillation used when static_model=True
+    STATIC_MODEL_NAME = "minishlab/M2V_base_output"
+    # ingestion batches at least this large are sharded over all GPUs
+    MULTI_GPU_MIN_DOCS = 10_000
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2", index_dir: str = None, index_type: str = None,
+                 static_model: bool = False):
+        # "hnsw": HNSW graph over float32 vectors, no training needed
+        # "hnsw_sq8": HNSW graph over 8-bit scalar-quantized vectors (4x smaller, int8 SIMD scan)
+        # "flat": exact inner-product search over float32 vectors
+        # "sq_fp16" / "sq8": exact scan over float16 / 8-bit quantized vectors (2x / 4x smaller)
+        # "ivfpq": inverted lists over product-quantized codes; also chosen automatically
+        #          for any type once the corpus reaches IVFPQ_MIN_DOCS
+        self.index_type = (index_type or os.getenv("VECTOR_INDEX_TYPE", "hnsw")).lower()
+        if self.index_type not in self.INDEX_TYPES:
+            raise ValueError(f"Unknown vector index type '{self.index_type}', expected one of {self.INDEX_TYPES}")
+        # HNSW build / query breadth: higher means better recall, slower build / search
+        self.hnsw_ef_construction = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+        self.hnsw_ef_search = int(os.getenv("HNSW_EF_SEARCH", "64"))
+        self.ivfpq_min_docs = int(os.getenv("IVFPQ_MIN_DOCS", "10000"))
+        self.ivf_nprobe = int(os.getenv("IVF_NPROBE", "16"))
+        # parameters of the index built by build_index(), saved next to it
+        self.index_params = {}
+        # static_model: averaged static token embeddings, no transformer forward pass
+        self.static_model = static_model
+        self.model_name = self.STATIC_MODEL_NAME if static_model else model_name
         self.index_dir = index_dir or os.path.join(os.path.dirname(__file__), "..", "vector_store")
         os.makedirs(self.index_dir, exist_ok=True)
+        # backend / precision of the loaded model; its vectors differ between variants
+        self.encoder_variant = "static" if static_model else "torch-fp32"
+        if static_model:
+            from model2vec import StaticModel
+            self.model = StaticModel.from_pretrained(self.model_name)
+            self.dim = self.model.dim
+        else:
+            self.model = self._load_model(model_name)
+            self.dim = self.model.get_sentence_embedding_dimension()
+        # one encoder process per GPU, started on the first large enough batch
+        self._multi_gpu = not static_model and torch.cuda.device_count() > 1
+        self._mp_pool = None
+        self.index = None
+        # set while self.index lives on a GPU (keeps the GPU resources alive too)
+        self._gpu_resources = None
+        # set while self.index reads its data from a read-only mapping of index_path
+        self._index_mapped = False
+        # a plain list while building; a MappedDocuments view of docs.bin after load()
+        self.documents: Sequence[str] = []
+        # documents passed to add_documents() but not yet embedded / indexed
+        self._pending: List[str] = []
+        # hashes of every added document, to skip re-ingested ones
+        self._seen: set = set()
+        self.add_buffer_size = int(os.getenv("VECTOR_ADD_BUFFER", "1024"))
         self.index_path = os.path.join(self.index_dir, "faiss.index")
+        # flat indexes are saved as float16 vectors instead of faiss.index
+        self.flat_vectors_path = os.path.join(self.index_dir, "flat_vectors.f16.npy")
+        self.docs_path = os.path.join(self.index_dir, "docs.bin")
+        # the hash function is part of the name: hashes from another one are recomputed
+        self.doc_hashes_path = os.path.join(self.index_dir, f"doc_hashes.{_DOC_HASH_NAME}.npy")
+        # documents of stores saved before docs.bin existed
         self.pickle_path = os.path.join(self.index_dir, "docs.pkl")
+        self.index_meta_path = os.path.join(self.index_dir, "index_meta.json")
+        # cached vectors are only reused by the same model, backend and precision
+        self.embedding_cache = EmbeddingCache(
+            os.path.join(self.index_dir, "emb_cache.db"), f"{self.model_name}|{self.encoder_variant}"
+        )
+        # repeated queries (token-budget retries, semantic cache lookups) reuse the embedding;
+        # entries are float16 bytes, half the size of the float32 array
+        self._encode_query_cached = lru_cache(maxsize=2048)(self._encode_query)
+        # HF model behind the single-query fast path (possibly compiled), or None
+        self._query_model = self._single_query_model()
+        if os.getenv("TORCH_COMPILE", "false").lower() == "true":
+            self._compile_encoder()
+
+    def _load_model(self, model_name: str) -> SentenceTransformer:
+        """PyTorch model by default; EMBEDDING_BACKEND=onnx selects an int8 ONNX Runtime model."""
+        if os.getenv("EMBEDDING_BACKEND", "torch").lower() == "onnx":
+            try:
+                return self._load_onnx_int8(model_name)
+            except Exception as e:
+                # optimum / onnxruntime not installed, or export failed
+                logger.warning("ONNX int8 backend unavailable (%s), falling back to PyTorch", e)
+        if torch.cuda.is_available():
+            # FP16 runs the transformer on tensor cores; outputs are cast back to float32
+            model = SentenceTransformer(model_name, device="cuda")
+            model.half()
+            self.encoder_variant = "cuda-fp16"
+            return model
+        return SentenceTransformer(model_name)
+
+    def _load_onnx_int8(self, model_name: str) -> SentenceTransformer:
+        """Dynamically int8-quantized ONNX export of model_name, created once under index_dir."""
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        config = "avx512_vnni" if _cpu_has_vnni() else "avx2"
+        file_name = f"model_qint8_{config}.onnx"
+        local_dir = os.path.join(self.index_dir, "onnx_" + model_name.replace("/", "__"))
+        if not os.path.exists(os.path.join(local_dir, "onnx", file_name)):
+            logger.info("Exporting %s to ONNX with %s int8 quantization", model_name, config)
+            model = SentenceTransformer(model_name, backend="onnx")
+            model.save(local_dir)
+            export_dynamic_quantized_onnx_model(model, config, local_dir)
+        model = SentenceTransformer(local_dir, backend="onnx", model_kwargs={"file_name": f"onnx/{file_name}"})
+        self.encoder_variant = f"onnx-qint8_{config}"
+        return model
 
-    def add_documents(self, docs: List[str]):
-        if not docs:
+    def reset(self):
+        """Forget the index and all documents, so the next add_documents() builds from scratch.
+
+        Files on disk are left in place until the next save().
+        """
+        self.index = None
+        self._gpu_resources = None
+        self._index_mapped = False
+        self.index_params = {}
+        self.documents = []
+        self._pending = []
+        self._seen = set()
+
+    def add_documents(self, docs: List[str], batch_size: int = 64):
+        """Queue docs for indexing; they are embedded and added once add_buffer_size accumulate.
+
+        Pending documents are flushed by flush(), save() and any search. Documents
+        already in the store (or earlier in docs) are skipped.
+        """
+        for doc in docs:
+            key = _doc_hash(doc)
+            if key not in self._seen:
+                self._seen.add(key)
+                self._pending.append(doc)
+        if len(self._pending) >= self.add_buffer_size:
+            self.flush(batch_size)
+
+    def flush(self, batch_size: int = 64):
+        """Embed and index all pending documents with one encode and one index.add."""
+        if not self._pending:
             return
-        embeddings = self.model.encode(docs, convert_to_numpy=True, show_progress_bar=True)
+        docs, self._pending = self._pending, []
+        embeddings = self._embed_documents(docs, batch_size)
         if self.index is None:
-            self.index = faiss.IndexFlatIP(self.dim)
-        # normalize for cosine via inner product
-        faiss.normalize_L2(embeddings)
+            # quantizers / coarse centroids are learned from the first batch
+            self.build_index(embeddings)
+        elif self._index_mapped:
+            # mapped IVF lists are read-only; take a private in-memory copy to add to
+            index = faiss.read_index(self.index_path)
+            self._configure_search(index)
+            self.index = index
+            self._index_mapped = False
         self.index.add(embeddings)
+        if not isinstance(self.documents, list):
+            self.documents = list(self.documents)
         self.documents.extend(docs)
 
+    def build_index(self, training_vecs: np.ndarray):
+        """Create (and train, if needed) the index for a corpus like training_vecs.
+
+        Large corpora get IVF-PQ regardless of index_type: each query then scans
+        ~nprobe/nlist of the compressed codes instead of every full vector.
+        """
+        n = len(training_vecs)
+        if (self.index_type == "ivfpq" or n >= self.ivfpq_min_docs) and n >= 256:
+            nlist = max(1, int(4 * np.sqrt(n)))
+            m = self._pq_subquantizers()
+            index = faiss.index_factory(self.dim, f"IVF{nlist},PQ{m}x8", faiss.METRIC_INNER_PRODUCT)
+            index.train(training_vecs)
+            self.index_params = {"type": "ivfpq", "nlist": nlist, "pq_m": m, "pq_nbits": 8, "nprobe": self.ivf_nprobe}
+        else:
+            if self.index_type == "ivfpq":
+                # PQ needs at least 2^nbits training points per sub-quantizer
+                logger.warning("Only %d vectors, too few to train IVF-PQ; using a flat index", n)
+                index = faiss.IndexFlatIP(self.dim)
+                self.index_params = {"type": "flat"}
+            else:
+                index = self._new_index()
+                self.index_params = {"type": self.index_type}
+            if not index.is_trained:
+                index.train(training_vecs)
+        self._configure_search(index)
+        self.index = self._to_gpu(index)
+        self._index_mapped = False
+
+    def _to_gpu(self, index):
+        """Copy index to GPU 0 when faiss has one; otherwise (or if unsupported) return it unchanged.
+
+        A GPU search has ~1ms of kernel launch overhead, so it pays off for
+        batched queries (search_batch) and large corpora rather than single lookups.
+        """
+        if faiss.get_num_gpus() == 0:
+            return index
+        try:
+            res = faiss.StandardGpuResources()
+            gpu_index = faiss.index_cpu_to_gpu(res, 0, index)
+        except Exception as e:
+            # e.g. HNSW indexes have no GPU implementation
+            logger.info("Keeping %s index on CPU: %s", type(index).__name__, e)
+            return index
+        self._gpu_resources = res
+        return gpu_index
+
+    def _pq_subquantizers(self) -> int:
+        """Largest divisor of dim that is at most dim // 8 (~8 dims per PQ code byte)."""
+        m = max(1, self.dim // 8)
+        while self.dim % m:
+            m -= 1
+        return m
+
+    def _new_index(self):
+        if self.index_type == "hnsw_sq8":
+            index = faiss.IndexHNSWSQ(self.dim, faiss.ScalarQuantizer.QT_8bit, 32, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type == "hnsw":
+            index = faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+        elif self.index_type in ("sq_fp16", "sq8"):
+            qtype = faiss.ScalarQuantizer.QT_fp16 if self.index_type == "sq_fp16" else faiss.ScalarQuantizer.QT_8bit
+            return faiss.IndexScalarQuantizer(self.dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        else:
+            return faiss.IndexFlatIP(self.dim)
+        index.hnsw.efConstruction = self.hnsw_ef_construction
+        self._configure_search(index)
+        return index
+
+    def _configure_search(self, index):
+        """Apply query-time parameters to a new or loaded index."""
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = self.hnsw_ef_search
+        if hasattr(index, "nprobe"):
+            index.nprobe = self.ivf_nprobe
+
+    def _embed_documents(self, docs: List[str], batch_size: int = 64) -> np.ndarray:
+        """Normalized embeddings for docs, encoding only those not in the embedding cache."""
+        embeddings = self.embedding_cache.get_many(docs, self.dim)
+        missing = [i for i, emb in enumerate(embeddings) if emb is None]
+        if missing:
+            new_embeddings = self._encode_documents([docs[i] for i in missing], batch_size)
+            self.embedding_cache.put_many([docs[i] for i in missing], new_embeddings)
+            for i, emb in zip(missing, new_embeddings):
+                embeddings[i] = emb
+        logger.info("Embedded %d new chunks (%d from cache)", len(missing), len(docs) - len(missing))
+        return np.vstack(embeddings).astype(np.float32)
+
+    def _encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        """L2-normalized float32 embeddings of texts (cosine similarity == inner product).
+
+        The models normalize as part of encoding, saving a separate pass over the matrix.
+        """
+        if self.static_model:
+            # StaticModel.encode already returns a numpy array
+            embeddings = self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar, normalize=True)
+        else:
+            with torch.inference_mode():
+                embeddings = self.model.encode(
+                    texts, batch_size=batch_size, convert_to_numpy=True, normalize_embeddings=True,
+                    show_progress_bar=show_progress_bar
+                )
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _encode_documents(self, texts: List[str], batch_size: int) -> np.ndarray:
+        """_encode() for document ingestion (model.encode already length-sorts its batches)."""
+        if self._multi_gpu and len(texts) >= self.MULTI_GPU_MIN_DOCS:
+            return np.asarray(self.model.encode(
+                texts, pool=self._multi_process_pool(), batch_size=128, normalize_embeddings=True,
+                convert_to_numpy=True
+            ), dtype=np.float32)
+        return self._encode(texts, batch_size, show_progress_bar=True)
+
+    def _multi_process_pool(self):
+        if self._mp_pool is None:
+            self._mp_pool = self.model.start_multi_process_pool()
+            atexit.register(SentenceTransformer.stop_multi_process_pool, self._mp_pool)
+        return self._mp_pool
+
     def save(self):
-        if self.index is not None:
-            faiss.write_index(self.index, self.index_path)
-        with open(self.pickle_path, "wb") as f:
-            pickle.dump(self.documents, f)
+        self.flush()
+        # a mapped index is unchanged since load(), and rewriting its file in place
+        # would pull the pages out from under the mapping
+        if self.index is not None and not self._index_mapped:
+            index = faiss.index_gpu_to_cpu(self.index) if self._gpu_resources is not None else self.index
+            if isinstance(index, faiss.IndexFlatIP):
+                # normalized components fit float16 comfortably: half the file size and
+                # page cache, at the cost of rebuilding the index in load()
+                with open(self.flat_vectors_path, "wb") as f:
+                    np.save(f, index.reconstruct_n(0, index.ntotal).astype(np.float16))
+                stale_path = self.index_path
+            else:
+                faiss.write_index(index, self.index_path)
+                stale_path = self.flat_vectors_path
+            if os.path.exists(stale_path):
+                os.remove(stale_path)
+            # empty when the index was loaded from a store saved without index_meta.json
+            if self.index_params:
+                with open(self.index_meta_path, "w") as f:
+                    json.dump(self.index_params, f)
+        MappedDocuments.write(self.documents, self.docs_path)
+        with open(self.doc_hashes_path, "wb") as f:
+            np.save(f, np.fromiter(self._seen, dtype=np.uint64, count=len(self._seen)))
 
     def load(self) -> bool:
         try:
-            if os.path.exists(self.index_path) and os.path.exists(self.pickle_path):
-                self.index = faiss.read_index(self.index_path)
-                with open(self.pickle_path, "rb") as f:
-                    self.documents = pickle.load(f)
+            has_docs = os.path.exists(self.docs_path)
+            has_index = os.path.exists(self.index_path) or os.path.exists(self.flat_vectors_path)
+            if has_index and (has_docs or os.path.exists(self.pickle_path)):
+                index, mapped = self._read_index()
+                if index.d != self.dim:
+                    # built with a different embedding model
+                    logger.warning("Saved index has dimension %d, model has %d; rebuilding", index.d, self.dim)
+                    return False
+                # read documents first so a bad docs file leaves the store empty
+                if has_docs:
+                    # only the length prefixes are read now; documents are decoded on access
+                    documents = MappedDocuments(self.docs_path)
+                else:
+                    with open(self.pickle_path, "rb") as f:
+                        documents = pickle.load(f)
+                self._configure_search(index)
+                self.index = self._to_gpu(index)
+                self._index_mapped = mapped and self._gpu_resources is None
+                self.documents = documents
+                self.index_params = {}
+                if os.path.exists(self.index_meta_path):
+                    with open(self.index_meta_path) as f:
+                        self.index_params = json.load(f)
+                if os.path.exists(self.doc_hashes_path):
+                    self._seen = set(np.load(self.doc_hashes_path).tolist())
+                else:
+                    self._seen = {_doc_hash(doc) for doc in documents}
                 return True
         except Exception as e:
-            print(f"Failed to load vector store: {e}")
+            logger.warning("Failed to load vector store: %s", e)
         return False
 
-    def search(self, query: str, k: int = 3) -> List[Tuple[str, float]]:
+    def _read_index(self):
+        """Read index_path, memory-mapping IVF inverted lists so the OS pages in only the lists searched.
+
+        Keep index_dir on local SSD: page faults replace the up-front read. FAISS
+        ignores the mmap flag for other index types and reads them into memory, and
+        flat indexes are rebuilt from their float16 vectors. Returns (index, mapped).
+        """
+        if os.path.exists(self.flat_vectors_path):
+            vectors = np.load(self.flat_vectors_path).astype(np.float32)
+            index = faiss.IndexFlatIP(vectors.shape[1])
+            index.add(vectors)
+            return index, False
+        try:
+            index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            return index, faiss.try_extract_index_ivf(index) is not None
+        except RuntimeError as e:
+            logger.debug("Memory-mapped index read failed (%s), reading into memory", e)
+            return faiss.read_index(self.index_path), False
+
+    def _single_query_model(self):
+        """The underlying HF model when the pipeline is plain transformer + mean pooling (+ normalize).
+
+        Such models can encode a single query without going through model.encode().
+        """
+        if self.static_model or getattr(self.model, "backend", "torch") != "torch":
+            return None
+        modules = list(self.model)
+        names = [type(m).__name__ for m in modules]
+        if names[:2] != ["Transformer", "Pooling"] or any(n != "Normalize" for n in names[2:]):
+            return None
+        if not hasattr(modules[0], "auto_model") or not _is_mean_pooling(modules[1]):
+            return None
+        return modules[0].auto_model
+
+    def _compile_encoder(self):
+        """torch.compile the single-query model into fused kernels, compiling now rather than on the first query.
+
+        Only the fast query path uses the compiled model; model.encode() stays eager.
+        """
+        torch_version = tuple(int(p) for p in torch.__version__.split("+")[0].split(".")[:2])
+        if self._query_model is None or torch_version < (2, 1) or (sys.version_info >= (3, 12) and torch_version < (2, 4)):
+            logger.info("torch.compile not supported for this model / torch %s, skipping", torch.__version__)
+            return
+        eager = self._query_model
+        try:
+            # dynamic shapes: query lengths vary, and a static graph would recompile per length
+            mode = "reduce-overhead" if self.model.device.type == "cuda" else "default"
+            self._query_model = torch.compile(eager, mode=mode, dynamic=True)
+            self._encode_single("warm up the compiled encoder")
+        except Exception as e:
+            logger.warning("torch.compile failed (%s), using the eager model", e)
+            self._query_model = eager
+
+    def _encode_single(self, query: str) -> np.ndarray:
+        """Tokenize, forward and mean-pool one query directly.
+
+        At batch size 1 the per-call glue in model.encode() (sorting, collation,
+        device moves, conversion) is a noticeable share of the latency.
+        """
+        tokens = self.model.tokenizer(
+            query, return_tensors="pt", truncation=True, max_length=self.model.max_seq_length
+        ).to(self.model.device)
+        with torch.inference_mode():
+            hidden = self._query_model(**tokens).last_hidden_state
+            mask = tokens["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+            emb = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            emb = torch.nn.functional.normalize(emb.float(), dim=1)
+        return emb.cpu().numpy()
+
+    def _encode_query(self, query: str) -> bytes:
+        if self._query_model is not None:
+            emb = self._encode_single(query)
+        else:
+            emb = self._encode([query])
+        return emb.astype(np.float16).tobytes()
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """L2-normalized float32 embedding of a single query, shape (1, dim).
+
+        Results are memoized at float16 precision (cosine scores move by < 1e-3).
+        """
+        return np.frombuffer(self._encode_query_cached(query), dtype=np.float16).reshape(1, self.dim).astype(np.float32)
+
+    def _hits(self, scores, ids) -> List[Tuple[int, float]]:
+        # IVF / HNSW pad missing neighbours with -1
+        mask = (ids >= 0) & (ids < len(self.documents))
+        return list(zip(ids[mask].tolist(), scores[mask].astype(float).tolist()))
+
+    def _search_embeddings(self, q_emb: np.ndarray, k: int) -> List[List[Tuple[int, float]]]:
+        """One index.search over all rows of q_emb (FAISS parallelizes across rows with OpenMP)."""
+        if self.index is None or len(self.documents) == 0:
+            return [[] for _ in range(len(q_emb))]
+        params = None
+        if hasattr(self.index, "hnsw") and k * 8 > self.hnsw_ef_search:
+            # keep the candidate list well above k, or recall drops for large k; passed
+            # per call so concurrent searches with different k don't interfere
+            params = faiss.SearchParametersHNSW(efSearch=k * 8)
+        D, I = self.index.search(q_emb, k, params=params)
+        return [self._hits(scores, ids) for scores, ids in zip(D, I)]
+
+    def search_indices(self, query: str, k: int = 3) -> List[Tuple[int, float]]:
+        """Like search(), but returns (document index, score) pairs."""
+        if self._pending:
+            self.flush()
         if self.index is None or len(self.documents) == 0:
             return []
-        q_emb = self.model.encode([query], convert_to_numpy=True)
-        faiss.normalize_L2(q_emb)
-        D, I = self.index.search(q_emb, k)
-        results = []
-        for score, idx in zip(D[0], I[0]):
-            if idx < len(self.documents):
-                results.append((self.documents[idx], float(score)))
-        return results
+        return self._search_embeddings(self.encode_query(query), k)[0]
+
+    def search(self, query: str, k: int = 3) -> List[Tuple[str, float]]:
+        return self._with_documents([self.search_indices(query, k)])[0]
+
+    def search_iter(self, query: str, k: int = 3) -> Iterator[Tuple[str, float]]:
+        """search() as a generator: each document is read only when its hit is consumed."""
+        for idx, score in self.search_indices(query, k):
+            yield self.documents[idx], score
+
+    def search_batch_indices(self, queries: List[str], k: int = 3, batch_size: int = 64) -> List[List[Tuple[int, float]]]:
+        """search_indices() for many queries: one encode call and one index search."""
+        if self._pending:
+            self.flush()
+        if self.index is None or len(self.documents) == 0 or not queries:
+            return [[] for _ in queries]
+        return self._search_embeddings(self._encode(queries, batch_size), k)
+
+    def search_batch(self, queries: List[str], k: int = 3, batch_size: int = 64) -> List[List[Tuple[str, float]]]:
+        """search() for many queries; prefer this over a loop of search() calls."""
+        return self._with_documents(self.search_batch_indices(queries, k, batch_size))
+
+    def _with_documents(self, hits_per_query) -> List[List[Tuple[str, float]]]:
+        return [[(self.documents[idx], score) for idx, score in hits] for hits in hits_per_query]